@@ -1,13 +1,42 @@
+import mmap
+import os
 import struct
-import pytinyxml2 as xml
-from typing import List, ByteString
-from typeguard import typechecked
+from lxml import etree
+from typing import List, Optional, Tuple, Union
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+# chunkMagic, byteSize, fxMagic, version, fxId, fxVersion, numPrograms, prgName, chunkSize
+HEADER_STRUCT = struct.Struct(">4si4siiii28si")
+
+# Shared across loads so the parser is set up once. It is strict: malformed patch XML must
+# raise rather than come back with sections silently missing.
+# lxml parsers must not be used from several threads at once.
+XML_PARSER = etree.XMLParser(collect_ids=False)
+
+# Compiled once so extraction does not re-parse the paths for every patch
+META_XPATH = etree.XPath("/patch/meta")
+PARAMETERS_XPATH = etree.XPath("/patch/parameters/*")
+
+# Markers delimiting the patch XML inside the FXP chunk
+XML_START = b"<?xml"
+PATCH_END = b"</patch>"
+
+# Byte-level search kept out of FXP.load so it can be swapped for a compiled implementation.
+# Missing markers give an empty or open-ended XML range so no surrounding bytes are lost.
+def find_xml_bounds(buf: Union[bytes, bytearray, mmap.mmap], offset: int, size: int) -> Tuple[int, int]:
+    start = buf.find(XML_START, offset, size)
+    if start == -1:
+        return size, size
+    end = buf.find(PATCH_END, start, size)
+    if end == -1:
+        return start, size
+    return start, end + len(PATCH_END)
 
 class FXP:
-    @typechecked
     def __init__(self, version: int, fxId: int, fxVersion: int, numPrograms: int, 
-                 prgName: str, chunkSize: int, fxp_header: ByteString, non_xml_data_before: ByteString, 
-                 xmlContent: ByteString, non_xml_data_after: ByteString, extracted_xml_data: dict, wavetables: List[ByteString]):
+                 prgName: str, chunkSize: int, fxp_header: Buffer, non_xml_data_before: Buffer, 
+                 xmlContent: Buffer, non_xml_data_after: Buffer, extracted_xml_data: dict, wavetables: List[Buffer]):
         assert len(prgName.encode('utf-8')) <= 28, "Program name must be at most 28 bytes long"
         
         self.version: int = version
@@ -16,71 +45,156 @@ class FXP:
         self.numPrograms: int = numPrograms
         self.prgName: str = prgName
         self.chunkSize: int = chunkSize
-        self.fxp_header: ByteString = fxp_header
-        self.non_xml_data_before: ByteString = non_xml_data_before
-        self.xmlContent: ByteString = xmlContent
-        self.non_xml_data_after: ByteString = non_xml_data_after
+        self.fxp_header: Buffer = fxp_header
+        self.non_xml_data_before: Buffer = non_xml_data_before
+        self.xmlContent: Buffer = xmlContent
+        self.non_xml_data_after: Buffer = non_xml_data_after
         self.extracted_xml_data = extracted_xml_data
-        self.wavetables: List[ByteString] = wavetables
+        self.wavetables: List[Buffer] = wavetables
+        # Whole file as read by load(), kept so callers can verify a round-trip without re-reading it
+        self._raw_bytes: Optional[memoryview] = None
+        # File mapping the buffers above point into, when loaded from disk, and the views load() made of it
+        self._mm: Optional[mmap.mmap] = None
+        self._mm_path: Optional[str] = None
+        self._views: Tuple[memoryview, ...] = ()
+        self._closed: bool = False
+
+    def __enter__(self) -> "FXP":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        # Unmap the source file now rather than whenever the views get garbage collected.
+        # Only the views load() made are released; buffers assigned by the caller are left alone.
+        # The FXP counts as closed afterwards even if a slice still held elsewhere keeps the
+        # mapping open, in which case the mapping goes away with that slice.
+        try:
+            self._unmap()
+        finally:
+            self._closed = True
+
+    def _unmap(self) -> None:
+        mm, views = self._mm, self._views
+        try:
+            for view in views:
+                view.release()
+            if mm is not None:
+                mm.close()
+        except BufferError as e:
+            raise ValueError("cannot release the FXP file mapping while slices of its buffers are still in use") from e
+        finally:
+            self._mm = None
+            self._mm_path = None
+            self._views = ()
+
+    def _rebase(self, data: bytes) -> None:
+        # Re-point the parts load() mapped at data, which holds the same bytes in the same order,
+        # so the mapping can be released; parts the caller assigned are kept as they are
+        view = memoryview(data)
+        offset = 0
+        for name in ("fxp_header", "non_xml_data_before", "xmlContent", "non_xml_data_after"):
+            part = getattr(self, name)
+            n = len(part)
+            if any(part is mapped for mapped in self._views):
+                setattr(self, name, view[offset:offset + n])
+            offset += n
+        self._raw_bytes = view
+        self._unmap()
 
     def extract_xml_data(self):
-        xml_doc = xml.XMLDocument()
-        xml_doc.Parse(self.xmlContent.decode(errors='ignore'))
+        # lxml parses a memoryview in place only from 6.0 on; older versions need bytes
+        xml_content = self.xmlContent if etree.LXML_VERSION >= (6,) else bytes(self.xmlContent)
+        try:
+            root = etree.fromstring(xml_content, XML_PARSER)
+        except etree.XMLSyntaxError:
+            # Like the old decode(errors='ignore'), tolerate stray bytes that are not valid UTF-8 by
+            # dropping them and parsing again; if none were dropped the damage is structural
+            raw = bytes(self.xmlContent)
+            cleaned = raw.decode('utf-8', errors='ignore').encode('utf-8')
+            if cleaned == raw:
+                raise
+            root = etree.fromstring(cleaned, XML_PARSER)
         extracted_data = {}
 
         # Extracting meta information
-        meta = xml_doc.FirstChildElement("patch").FirstChildElement("meta")
-        if meta is not None:
-            extracted_data["meta"] = {
-                "name": meta.Attribute("name"),
-                "category": meta.Attribute("category"),
-                "comment": meta.Attribute("comment"),
-                "author": meta.Attribute("author")
-            }
+        meta = META_XPATH(root)
+        if meta:
+            extracted_data["meta"] = dict(meta[0].attrib)
 
         # Extracting parameters
-        parameters = xml_doc.FirstChildElement("patch").FirstChildElement("parameters")
-        param = parameters.FirstChildElement()
-        extracted_data["parameters"] = {}
-        while param is not None:
-            name = param.Value()
-            param_type = param.Attribute("type")
-            param_value = param.Attribute("value")
-            extracted_data["parameters"][name] = {"type": param_type, "value": param_value}
-            param = param.NextSiblingElement()
+        extracted_data["parameters"] = {
+            param.tag: {"type": param.get("type"), "value": param.get("value")} for param in PARAMETERS_XPATH(root)
+        }
 
         # Add extraction logic for other elements as needed
 
         return extracted_data
 
     @staticmethod
-    @typechecked
     def load(filename: str) -> "FXP":
+        # Map the file instead of copying it; every part below is a view into the page cache
         with open(filename, 'rb') as f:
-            fxp_header: ByteString = f.read(60)
-            assert len(fxp_header) == 60, "FXP header size must be 60 bytes"
-            content = f.read()
-            start = content.find(b"<?xml")
-            end = content.find(b"</patch>") + len(b"</patch>")
-            non_xml_data_before = content[:start] if start != -1 else b''
-            xml_content = content[start:end] if start != -1 and end != -1 else b''
-            non_xml_data_after = content[end:] if end != -1 else b''
-
-            # Extract XML data
-            fxp_instance = FXP(0, 0, 0, 0, '', 0, fxp_header, non_xml_data_before, xml_content, non_xml_data_after, {}, [])
-            extracted_xml_data = fxp_instance.extract_xml_data()
-
-            return FXP(0, 0, 0, 0, '', 0, fxp_header, non_xml_data_before, xml_content, non_xml_data_after, extracted_xml_data, [])
-
-    @typechecked
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER_STRUCT.size:
+                raise ValueError(f"{filename} is shorter than the {HEADER_STRUCT.size}-byte FXP header")
+            # Reject non-FXP and non-chunk presets from the first 12 bytes, before anything is mapped
+            magic = f.read(12)
+            if magic[0:4] != b"CcnK" or magic[8:12] != b"FPCh":
+                raise ValueError(f"{filename} is not an FXP chunk preset")
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        views: Tuple[memoryview, ...] = ()
+        try:
+            _, _, _, version, fxId, fxVersion, numPrograms, prg_name, chunkSize = HEADER_STRUCT.unpack_from(buf, 0)
+            prgName = prg_name.split(b'\x00', 1)[0].decode('utf-8', errors='ignore')
+
+            # The XML lives inside the chunk the header declares, so trailing data past it is never scanned
+            chunk_end = HEADER_STRUCT.size + chunkSize if 0 < chunkSize <= size - HEADER_STRUCT.size else size
+            start, end = find_xml_bounds(buf, HEADER_STRUCT.size, chunk_end)
+
+            # Slice through a memoryview so the parts share the file buffer instead of copying it:
+            # header, data before the XML, the XML, data after it, and the whole file
+            with memoryview(buf) as view:
+                views = (view[:HEADER_STRUCT.size], view[HEADER_STRUCT.size:start], view[start:end], view[end:size], view[:size])
+            fxp_header, non_xml_data_before, xml_content, non_xml_data_after, raw_bytes = views
+
+            fxp = FXP(version, fxId, fxVersion, numPrograms, prgName, chunkSize, fxp_header, non_xml_data_before, xml_content, non_xml_data_after, {}, [])
+            fxp._raw_bytes = raw_bytes
+            fxp._mm = buf
+            fxp._mm_path = filename
+            fxp._views = views
+
+            # Extract XML data; a file without any stays at {}, while a "<?xml" that does not parse raises
+            if start != end:
+                fxp.extracted_xml_data = fxp.extract_xml_data()
+        except BaseException:
+            # Don't leave the file mapped (and locked, on Windows) until the traceback is collected
+            for part in views:
+                part.release()
+            buf.close()
+            raise
+
+        return fxp
+
+    def _parts(self) -> List[Buffer]:
+        return [self.fxp_header, self.non_xml_data_before, self.xmlContent, self.non_xml_data_after, *self.wavetables]
+
+    def to_bytes(self) -> bytes:
+        if self._closed:
+            raise ValueError("FXP is closed")
+        return b"".join(self._parts())
+
     def save(self, filename: str) -> None:
+        # Assemble before opening: the parts may be views into a mapping of this very file.
+        # Saving over it needs the mapping gone first: Windows refuses to truncate a mapped
+        # file, and on POSIX the views would be left pointing past EOF.
+        data = self.to_bytes()
+        if self._mm_path is not None and os.path.exists(filename) and os.path.samefile(filename, self._mm_path):
+            self._rebase(data)
         with open(filename, 'wb') as f:
-            f.write(self.fxp_header)
-            f.write(self.non_xml_data_before)
-            f.write(self.xmlContent)
-            f.write(self.non_xml_data_after)
-            for wt in self.wavetables:
-                f.write(wt)
+            f.write(data)
 
 if __name__ == "__main__":
     # Load the original FXP file
@@ -90,16 +204,20 @@ if __name__ == "__main__":
     original_fxp.save(r"C:\Users\Juan\Desktop\new_Boom.fxp")
 
     # Assert that the contents of the original and new files are identical
-    original_fxp_data = open(r"C:\Users\Juan\Desktop\Boom.fxp", "rb").read()
-    new_fxp_data = open(r"C:\Users\Juan\Desktop\new_Boom.fxp", "rb").read()
-    assert original_fxp_data == new_fxp_data, "The original and new FXP files are not identical"
+    # bytes() turns this into a memcmp; memoryview == bytes compares item by item
+    assert original_fxp._raw_bytes is not None, "FXP.load always keeps the file buffer"
+    assert bytes(original_fxp._raw_bytes) == original_fxp.to_bytes(), "The original and new FXP files are not identical"
+
+    # The file buffers are no longer needed; extracted_xml_data holds plain Python objects
+    original_fxp.close()
 
-    # Write the extracted data to a new file
+    # Write the extracted data to a new file in one go
+    lines = []
+    for key, value in original_fxp.extracted_xml_data.items():
+        if isinstance(value, dict):
+            lines.append(f"{key}:\n")
+            lines.extend(f"    {subkey}: {subvalue}\n" for subkey, subvalue in value.items())
+        else:
+            lines.append(f"{key}: {value}\n")
     with open(r"C:\Users\Juan\Desktop\extracted_data.txt", "w") as file:
-        for key, value in original_fxp.extracted_xml_data.items():
-            if isinstance(value, dict):
-                file.write(f"{key}:\n")
-                for subkey, subvalue in value.items():
-                    file.write(f"    {subkey}: {subvalue}\n")
-            else:
-                file.write(f"{key}: {value}\n")
+        file.write("".join(lines))
@@ -0,0 +1,182 @@
+import mmap
+
+import pytest
+from lxml import etree
+
+from panflute_test import FXP, HEADER_STRUCT, find_xml_bounds
+
+XML = (b'<?xml version="1.0" encoding="UTF-8"?>\n<patch revision="16">'
+       b'<meta name="Boom" category="Bass" comment="c" author="me"/>'
+       b'<parameters><volume type="2" value="-2.0"/><scene_active type="0" value="0"/></parameters></patch>')
+BEFORE = b"sub3" + b"\x00" * 8
+AFTER = b"\x00\x01wavetable-data"
+
+
+def make_fxp(body: bytes, chunk_size=None, fx_magic: bytes = b"FPCh") -> bytes:
+    if chunk_size is None:
+        chunk_size = len(body)
+    return HEADER_STRUCT.pack(b"CcnK", 0, fx_magic, 1, 0x636a7333, 1, 1, b"Boom", chunk_size) + body
+
+
+@pytest.fixture
+def write(tmp_path):
+    def write(data: bytes, name: str = "patch.fxp") -> str:
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def mapped(monkeypatch):
+    # Record every mapping load() creates so tests can check it was closed
+    created = []
+    real_mmap = mmap.mmap
+
+    def spy(*args, **kwargs):
+        mm = real_mmap(*args, **kwargs)
+        created.append(mm)
+        return mm
+
+    monkeypatch.setattr(mmap, "mmap", spy)
+    return created
+
+
+def test_find_xml_bounds():
+    buf = BEFORE + XML + AFTER
+    assert find_xml_bounds(buf, 0, len(buf)) == (len(BEFORE), len(BEFORE) + len(XML))
+
+
+def test_find_xml_bounds_missing_start():
+    buf = BEFORE + AFTER
+    assert find_xml_bounds(buf, 0, len(buf)) == (len(buf), len(buf))
+
+
+def test_find_xml_bounds_unterminated():
+    buf = BEFORE + b"<?xml version='1.0'?><patch>"
+    assert find_xml_bounds(buf, 0, len(buf)) == (len(BEFORE), len(buf))
+
+
+def test_find_xml_bounds_stops_at_limit():
+    buf = BEFORE + XML
+    assert find_xml_bounds(buf, 0, len(BEFORE)) == (len(BEFORE), len(BEFORE))
+
+
+def test_load_round_trip(write):
+    data = make_fxp(BEFORE + XML + AFTER)
+    fxp = FXP.load(write(data))
+    assert (fxp.version, fxp.fxId, fxp.numPrograms, fxp.prgName) == (1, 0x636a7333, 1, "Boom")
+    assert bytes(fxp.xmlContent) == XML
+    assert fxp.extracted_xml_data == {
+        "meta": {"name": "Boom", "category": "Bass", "comment": "c", "author": "me"},
+        "parameters": {"volume": {"type": "2", "value": "-2.0"}, "scene_active": {"type": "0", "value": "0"}},
+    }
+    assert fxp.to_bytes() == data
+
+
+def test_load_without_xml(write):
+    data = make_fxp(BEFORE + AFTER)
+    fxp = FXP.load(write(data))
+    assert fxp.extracted_xml_data == {}
+    assert fxp.to_bytes() == data
+
+
+def test_load_unterminated_xml_raises(write):
+    with pytest.raises(etree.XMLSyntaxError):
+        FXP.load(write(make_fxp(BEFORE + XML[:-len(b"</patch>")])))
+
+
+def test_load_malformed_xml_raises(write):
+    xml = XML.replace(b'author="me"/>', b'author="me">')
+    with pytest.raises(etree.XMLSyntaxError):
+        FXP.load(write(make_fxp(BEFORE + xml + AFTER)))
+
+
+def test_load_tolerates_invalid_utf8(write):
+    xml = XML.replace(b'comment="c"', b'comment="caf\xe9"')
+    data = make_fxp(BEFORE + xml + AFTER)
+    fxp = FXP.load(write(data))
+    assert fxp.extracted_xml_data["meta"]["comment"] == "caf"
+    assert fxp.to_bytes() == data
+
+
+@pytest.mark.parametrize("chunk_size", [0, -5, 1 << 30])
+def test_bogus_chunk_size_searches_whole_file(write, chunk_size):
+    data = make_fxp(BEFORE + XML + AFTER, chunk_size=chunk_size)
+    fxp = FXP.load(write(data))
+    assert bytes(fxp.xmlContent) == XML
+    assert fxp.to_bytes() == data
+
+
+def test_xml_past_declared_chunk_is_not_searched(write):
+    data = make_fxp(BEFORE + XML + AFTER, chunk_size=len(BEFORE))
+    fxp = FXP.load(write(data))
+    assert fxp.extracted_xml_data == {}
+    assert bytes(fxp.non_xml_data_before) == BEFORE
+    assert fxp.to_bytes() == data
+
+
+def test_load_rejects_short_file(write):
+    path = write(b"CcnK")
+    with pytest.raises(ValueError, match="shorter than"):
+        FXP.load(path)
+
+
+def test_load_rejects_bad_magic_without_mapping(write, mapped):
+    path = write(make_fxp(BEFORE + XML, fx_magic=b"FxCk"))
+    with pytest.raises(ValueError, match="not an FXP chunk preset"):
+        FXP.load(path)
+    assert mapped == []
+
+
+def test_load_failure_releases_mapping(write, mapped):
+    with pytest.raises(etree.XMLSyntaxError):
+        FXP.load(write(make_fxp(BEFORE + b"<?xml version='1.0'?>" + AFTER)))
+    assert len(mapped) == 1 and mapped[0].closed
+
+
+def test_close_releases_mapping(write, mapped):
+    fxp = FXP.load(write(make_fxp(BEFORE + XML + AFTER)))
+    fxp.close()
+    assert mapped[0].closed
+    assert fxp.extracted_xml_data["meta"]["name"] == "Boom"
+    with pytest.raises(ValueError, match="FXP is closed"):
+        fxp.to_bytes()
+    with pytest.raises(ValueError, match="FXP is closed"):
+        fxp.save(write(b"", "out.fxp"))
+
+
+def test_close_with_outstanding_slice(write):
+    fxp = FXP.load(write(make_fxp(BEFORE + XML + AFTER)))
+    held = fxp.xmlContent[0:5]
+    with pytest.raises(ValueError, match="still in use"):
+        fxp.close()
+    with pytest.raises(ValueError, match="FXP is closed"):
+        fxp.to_bytes()
+    held.release()
+    fxp.close()
+
+
+def test_close_leaves_caller_buffers_alone(write):
+    fxp = FXP.load(write(make_fxp(BEFORE + XML + AFTER)))
+    own = memoryview(XML)
+    fxp.xmlContent = own
+    fxp.close()
+    assert bytes(own[:5]) == b"<?xml"
+
+
+def test_context_manager_closes(write, mapped):
+    with FXP.load(write(make_fxp(BEFORE + XML + AFTER))) as fxp:
+        assert fxp.to_bytes()
+    assert mapped[0].closed
+
+
+def test_save_over_source_file(write, mapped):
+    data = make_fxp(BEFORE + XML + AFTER)
+    path = write(data)
+    fxp = FXP.load(path)
+    fxp.save(path)
+    assert mapped[0].closed
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert fxp.to_bytes() == data